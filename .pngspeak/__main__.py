@@ -1,5 +1,15 @@
 #!/usr/bin/env python3
-import sys, argparse, struct, zlib, os, pathlib, random
+import sys, argparse, struct, io, os, pathlib, random, contextlib
+
+try:
+    from zlib_ng import zlib_ng as zlib
+except ImportError: # zlib-ng is optional, it is a drop-in for zlib with faster crc32 and deflate
+    import zlib
+
+# Precompiled packers for the fixed-layout PNG fields
+_U32 = struct.Struct(">I")
+_CHUNK_HEADER = struct.Struct(">I4s")
+_IHDR = struct.Struct(">IIBBBBB")
 
 def read_bytes_from_source(n, rand_source):
     if rand_source is not None: # Ensure rand_source can be an empty string
@@ -15,117 +25,229 @@ def read_bytes_from_source(n, rand_source):
                 return os.urandom(n)
             except (NotImplementedError, OSError): # Fallback if os.urandom fails
                 return bytes(random.getrandbits(8) for _ in range(n))
-        return (encoded_bytes * (n // len(encoded_bytes) + 1))[:n]
-    else: # No --rand flag
+        # Repeat the string into a buffer of exactly n bytes, doubling the filled prefix each pass
+        buf = bytearray(n)
+        with memoryview(buf) as view:
+            filled = min(len(encoded_bytes), n)
+            view[:filled] = encoded_bytes[:filled]
+            while filled < n:
+                step = min(filled, n - filled)
+                view[filled : filled + step] = view[:step]
+                filled += step
+        return buf
+    else: # No --rand flag (--rand /dev/random still reads the device as a file)
         try:
-            with open('/dev/random', 'rb') as f:
-                return f.read(n)
-        except OSError: # /dev/random not available or other issue
-            try:
-                return os.urandom(n) # Preferred fallback
-            except (NotImplementedError, OSError): # Fallback if os.urandom also fails
-                return bytes(random.getrandbits(8) for _ in range(n)) # Last resort: Python's random
-
-def write_chunk(out, chunk_type, data):
-    out.write(struct.pack(">I", len(data)))
-    out.write(chunk_type)
-    out.write(data)
-    checksum = zlib.crc32(chunk_type + data) & 0xffffffff
-    out.write(struct.pack(">I", checksum))
-
-def upscale_image(data, width, height, uw, uh):
+            return os.urandom(n) # getrandom(2), never blocks once the pool is initialised
+        except (NotImplementedError, OSError): # Fallback if os.urandom fails
+            return bytes(random.getrandbits(8) for _ in range(n)) # Last resort: Python's random
+
+def _hex_bytes_str(n):
+    # Same as n.to_bytes(minimal length, 'big').hex(), without building the bytes object
+    hex_str = f"{n:x}"
+    return "0" + hex_str if len(hex_str) % 2 else hex_str
+
+def write_chunk(out, chunk_type, data, length=None):
+    # data is either a bytes-like object or, when length is given, an iterable of
+    # bytes-like pieces that are written and checksummed one at a time
+    if length is None:
+        length = len(data)
+        data = (data,)
+    out.write(_CHUNK_HEADER.pack(length, chunk_type))
+    checksum = zlib.crc32(chunk_type)
+    for piece in data:
+        out.write(piece)
+        checksum = zlib.crc32(piece, checksum)
+    out.write(_U32.pack(checksum & 0xffffffff))
+
+def chunk_bytes(chunk_type, data):
+    # A whole (small) chunk as one bytes object, so several chunks can go out in a single write
+    checksum = zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff
+    return b"".join((_CHUNK_HEADER.pack(len(data), chunk_type), data, _U32.pack(checksum)))
+
+def write_chunk_streamed(out, chunk_type, pieces):
+    # Write a chunk whose length is only known once all pieces have been produced. A seekable
+    # output gets the pieces directly and the length is patched in afterwards; anything else
+    # (a pipe, or a file opened for append) gets them via a temporary file
+    if not _can_patch(out):
+        import tempfile
+        with tempfile.TemporaryFile() as spool:
+            for piece in pieces:
+                spool.write(piece)
+            length = spool.tell()
+            spool.seek(0)
+            write_chunk(out, chunk_type, _read_spool(spool), length)
+        return
+
+    length_pos = out.tell()
+    out.write(_CHUNK_HEADER.pack(0, chunk_type))
+    checksum = zlib.crc32(chunk_type)
+    length = 0
+    for piece in pieces:
+        out.write(piece)
+        checksum = zlib.crc32(piece, checksum)
+        length += len(piece)
+    out.write(_U32.pack(checksum & 0xffffffff))
+    end_pos = out.tell()
+    out.seek(length_pos)
+    out.write(_U32.pack(length))
+    out.seek(end_pos)
+
+@contextlib.contextmanager
+def _buffered(out):
+    # Coalesce the many small writes of a PNG into few syscalls when out is an unbuffered raw stream
+    if not isinstance(out, io.RawIOBase):
+        yield out
+        return
+    buffered = io.BufferedWriter(out, buffer_size=1 << 20)
+    try:
+        yield buffered
+    finally:
+        buffered.detach() # flushes, and leaves the caller's stream open
+
+def _read_spool(spool, size=65536):
+    # Yield the rest of spool as memoryview slices of one reusable buffer instead of a new bytes per read
+    buf = bytearray(size)
+    view = memoryview(buf)
+    while True:
+        n = spool.readinto(buf)
+        if not n:
+            break
+        yield view[:n]
+
+def _can_patch(out):
+    if not out.seekable():
+        return False
+    try: # Writes to an O_APPEND file always land at the end, so seeking back would not patch anything
+        import fcntl
+        return not fcntl.fcntl(out.fileno(), fcntl.F_GETFL) & os.O_APPEND
+    except (ImportError, OSError): # No fcntl, or no file descriptor (e.g. io.BytesIO)
+        return True
+
+def _upscale_bilinear_kernel(src, result):
     """
-    Pillow-compatible bilinear interpolation for upscaling images.
-    This creates blended pixel values that match Pillow's default interpolation behavior,
-    making the embedded data unrecoverable while providing visually correct upscaling.
+    Per-pixel bilinear upscale of src (h, w, 4) into result (uh, uw, 4).
+    Mirrors the arithmetic of the NumPy path exactly; compiled with numba when available.
     """
-    bpp = 4
-    result = bytearray(uw * uh * bpp)
-    
-    for out_y in range(uh):
+    height, width, bpp = src.shape
+    uh, uw = result.shape[0], result.shape[1]
+    for out_y in prange(uh):
+        src_y = (out_y + 0.5) * height / uh - 0.5
+        y0 = max(0, int(src_y))
+        y1 = min(y0 + 1, height - 1)
+        dy = src_y - y0
         for out_x in range(uw):
-            # Calculate source coordinates with floating point precision
             src_x = (out_x + 0.5) * width / uw - 0.5
-            src_y = (out_y + 0.5) * height / uh - 0.5
-            
-            # Get integer coordinates and fractional parts
-            x0 = int(src_x)
-            y0 = int(src_y)
+            x0 = max(0, int(src_x))
             x1 = min(x0 + 1, width - 1)
-            y1 = min(y0 + 1, height - 1)
-            
-            # Clamp to bounds
-            x0 = max(0, x0)
-            y0 = max(0, y0)
-            
-            # Calculate fractional parts
             dx = src_x - x0
-            dy = src_y - y0
-            
-            # Get the four surrounding pixels
-            def get_pixel(x, y):
-                offset = (y * width + x) * bpp
-                return [data[offset + c] for c in range(bpp)]
-            
-            p00 = get_pixel(x0, y0)
-            p10 = get_pixel(x1, y0)
-            p01 = get_pixel(x0, y1)
-            p11 = get_pixel(x1, y1)
-            
-            # Bilinear interpolation
-            out_offset = (out_y * uw + out_x) * bpp
             for c in range(bpp):
-                # Interpolate horizontally for top and bottom rows
-                top = p00[c] * (1 - dx) + p10[c] * dx
-                bottom = p01[c] * (1 - dx) + p11[c] * dx
-                
-                # Interpolate vertically
+                top = src[y0, x0, c] * (1 - dx) + src[y0, x1, c] * dx
+                bottom = src[y1, x0, c] * (1 - dx) + src[y1, x1, c] * dx
                 value = top * (1 - dy) + bottom * dy
-                result[out_offset + c] = max(0, min(255, int(round(value))))
-    
-    return bytes(result)
+                result[out_y, out_x, c] = max(0, min(255, round(value)))
+
+prange = range # Replaced by numba.prange when the kernel is compiled
+
+# numba takes ~0.25 s to import and up to ~1 s more to load or compile the kernel, so it only pays off
+# for large upscales; smaller ones stay on the NumPy path
+_JIT_MIN_PIXELS = 1 << 23
+_upscale_bilinear_jit = None
+
+def _get_upscale_bilinear_jit():
+    # Import numba and compile the kernel on first use; returns None if numba is not installed
+    global _upscale_bilinear_jit, prange
+    if _upscale_bilinear_jit is None:
+        try:
+            from numba import njit, prange
+        except ImportError: # numba is optional, upscale_image falls back to plain NumPy
+            _upscale_bilinear_jit = False
+        else:
+            _upscale_bilinear_jit = njit(parallel=True, cache=True, nogil=True)(_upscale_bilinear_kernel)
+    return _upscale_bilinear_jit or None
+
+def upscale_image(data, width, height, uw, uh, resample=None):
+    """
+    Pillow-compatible bilinear interpolation for upscaling images.
+    This creates blended pixel values that match Pillow's default interpolation behavior,
+    making the embedded data unrecoverable while providing visually correct upscaling.
+    If resample names a Pillow filter (nearest, bilinear, bicubic, lanczos), the resize
+    is handed to Pillow's C implementation instead.
+    """
+    if resample is not None:
+        from PIL import Image
+        img = Image.frombuffer('RGBA', (width, height), bytes(data), 'raw', 'RGBA', 0, 1)
+        return img.resize((uw, uh), getattr(Image.Resampling, resample.upper())).tobytes()
+
+    import numpy as np
+
+    bpp = 4
+    src = np.frombuffer(data, dtype=np.uint8, count=width * height * bpp).reshape(height, width, bpp)
+
+    kernel = _get_upscale_bilinear_jit() if uw * uh >= _JIT_MIN_PIXELS else None
+    if kernel is not None:
+        result = np.empty((uh, uw, bpp), dtype=np.uint8)
+        kernel(src, result)
+        return result.tobytes()
+
+    def axis_coords(size, out_size):
+        # Source coordinates with floating point precision, for every output index at once
+        pos = (np.arange(out_size) + 0.5) * size / out_size - 0.5
+        # Integer coordinates (truncated like int()), clamped to bounds, and fractional parts
+        lo = np.maximum(pos.astype(np.intp), 0)
+        hi = np.minimum(lo + 1, size - 1)
+        return lo, hi, pos - lo
 
-def encode(input_stream, output_stream, cli_width_arg, cli_height_arg, cli_length_arg, rand_source, uw=None, uh=None):
-    import tempfile
+    x0, x1, dx = axis_coords(width, uw)
+    y0, y1, dy = axis_coords(height, uh)
+    wx0 = (1 - dx)[:, None]
+    wx1 = dx[:, None]
+
+    result = np.empty((uh, uw, bpp), dtype=np.uint8)
+    # Work through the output in bands of rows to keep the float intermediates small
+    band = max(1, (1 << 20) // (uw * bpp))
+    for start in range(0, uh, band):
+        rows = slice(start, start + band)
+        # Interpolate horizontally for top and bottom rows
+        top_src = src[y0[rows]]
+        bottom_src = src[y1[rows]]
+        top = top_src[:, x0] * wx0 + top_src[:, x1] * wx1
+        bottom = bottom_src[:, x0] * wx0 + bottom_src[:, x1] * wx1
+
+        # Interpolate vertically
+        wy1 = dy[rows, None, None]
+        value = top * (1 - wy1) + bottom * wy1
+        result[rows] = np.clip(np.rint(value), 0, 255)
+
+    return result.tobytes()
+
+def encode(input_stream, output_stream, cli_width_arg, cli_height_arg, cli_length_arg, rand_source, uw=None, uh=None, resample=None, level=1):
+    import numpy as np
 
     # 1. Read all input data first
-    # input_stream is expected to be an io.BytesIO or similar seekable stream
-    if hasattr(input_stream, 'getvalue'): # Likely an io.BytesIO from our main()
-        raw_input_bytes = input_stream.getvalue()
+    if hasattr(input_stream, 'getbuffer'): # io.BytesIO: use its buffer directly instead of a getvalue() copy
+        raw_input_bytes = input_stream.getbuffer()
     else: # Fallback for other stream types, read it all
-        with tempfile.TemporaryFile() as tf:
-            chunk = input_stream.read(8192)
-            current_size = 0
-            while chunk:
-                tf.write(chunk)
-                current_size += len(chunk)
-                chunk = input_stream.read(8192)
-            tf.seek(0)
-            raw_input_bytes = tf.read()
+        raw_input_bytes = input_stream.read()
 
     actual_raw_input_len = len(raw_input_bytes)
 
-    # 2. Determine the data_to_embed and the length_for_header based on cli_length_arg
+    # 2. Determine the length_for_header (the input is padded or truncated to it further down)
     if cli_length_arg is not None:
         # Always use the user-supplied length for the header
         length_for_header = cli_length_arg
-        if actual_raw_input_len < cli_length_arg:
-            # Pad raw input data
-            padding_needed = cli_length_arg - actual_raw_input_len
-            data_to_embed = raw_input_bytes + read_bytes_from_source(padding_needed, rand_source)
-        elif actual_raw_input_len > cli_length_arg:
-            # Truncate raw input data
-            data_to_embed = raw_input_bytes[:cli_length_arg]
-        else:
-            # Length matches
-            data_to_embed = raw_input_bytes
     else:
         # No --length argument, use actual input length for header and data
         length_for_header = actual_raw_input_len
-        data_to_embed = raw_input_bytes
+
+    # Padding up to --length is read now, because a short --rand file can supply fewer bytes
+    # than asked for and the grid is sized from the data actually obtained
+    input_len = min(actual_raw_input_len, length_for_header)
+    length_padding = b""
+    if input_len < length_for_header:
+        length_padding = read_bytes_from_source(length_for_header - input_len, rand_source)
 
     # 3. Calculate PNG grid dimensions (grid_w, grid_h)
-    current_data_len = len(data_to_embed)
+    current_data_len = input_len + len(length_padding)
     bpp = 4
     
     pixels_needed = (current_data_len + bpp - 1) // bpp
@@ -154,168 +276,263 @@ def encode(input_stream, output_stream, cli_width_arg, cli_height_arg, cli_lengt
         
     final_pixel_grid_capacity = grid_w * grid_h * bpp
     
-    # 4. Adjust data_to_embed to fit the grid (final_pixel_data)
-    final_pixel_data = data_to_embed
-    if len(final_pixel_data) < final_pixel_grid_capacity:
-        grid_padding_needed = final_pixel_grid_capacity - len(final_pixel_data)
-        final_pixel_data += read_bytes_from_source(grid_padding_needed, rand_source)
-    elif len(final_pixel_data) > final_pixel_grid_capacity:
-        final_pixel_data = final_pixel_data[:final_pixel_grid_capacity] # Truncate to fit grid
+    # 4. Fill one buffer of exactly the grid's size (final_pixel_data): the input truncated to
+    # --length and the grid, then padding up to --length, then padding up to the grid
+    final_pixel_data = bytearray(final_pixel_grid_capacity)
+    input_end = min(input_len, final_pixel_grid_capacity)
+    data_end = min(current_data_len, final_pixel_grid_capacity)
+    final_pixel_data[:input_end] = memoryview(raw_input_bytes)[:input_end]
+    final_pixel_data[input_end:data_end] = memoryview(length_padding)[:data_end - input_end]
+    if data_end < final_pixel_grid_capacity:
+        grid_padding = read_bytes_from_source(final_pixel_grid_capacity - data_end, rand_source)
+        # Assign into a slice of the same size so a short --rand file leaves zeros rather than shrinking the buffer
+        final_pixel_data[data_end : data_end + len(grid_padding)] = grid_padding
 
     # 5. Write PNG
-    output_stream.write(b"\x89PNG\r\n\x1a\n")
-
     ihdr_w = uw if uw else grid_w
     ihdr_h = uh if uh else grid_h
-    ihdr = struct.pack(">IIBBBBB", ihdr_w, ihdr_h, 8, 6, 0, 0, 0)
-    write_chunk(output_stream, b'IHDR', ihdr)
+    ihdr = _IHDR.pack(ihdr_w, ihdr_h, 8, 6, 0, 0, 0)
     
     # iTXt header with new format using length_for_header (always original input length or --length)
-    hex_val_for_header_str = length_for_header.to_bytes((length_for_header.bit_length() + 7) // 8 or 1, 'big').hex()
-    len_of_part2_as_str_in_bytes = len(hex_val_for_header_str.encode('utf-8'))
+    hex_val_for_header_str = _hex_bytes_str(length_for_header)
+    len_of_part2_as_str_in_bytes = len(hex_val_for_header_str) # hex digits are single-byte in utf-8
     # Use dynamic length for part1: only as many hex bytes as needed to represent the length
-    hex_len_of_part2_str = len_of_part2_as_str_in_bytes.to_bytes((len_of_part2_as_str_in_bytes.bit_length() + 7) // 8 or 1, 'big').hex()
+    hex_len_of_part2_str = _hex_bytes_str(len_of_part2_as_str_in_bytes)
     itxt_text_content = f"{hex_len_of_part2_str} {hex_val_for_header_str}"
     itxt_keyword_and_params = b"license\x00\x00\x00\x00\x00"
-    write_chunk(output_stream, b"iTXt", itxt_keyword_and_params + itxt_text_content.encode("utf-8"))
 
     # IDAT
     data_for_idat_processing = final_pixel_data
     idat_processing_w = grid_w
     idat_processing_h = grid_h
 
-    if uw and uh:
-        data_for_idat_processing = upscale_image(final_pixel_data, grid_w, grid_h, uw, uh)
+    if uw and uh and (uw, uh) != (grid_w, grid_h): # an upscale to the grid's own size is the identity
+        data_for_idat_processing = upscale_image(final_pixel_data, grid_w, grid_h, uw, uh, resample)
         idat_processing_w = uw
         idat_processing_h = uh
 
-    raw = bytearray()
-    for y in range(idat_processing_h):
-        raw.append(0)
-        start = y * idat_processing_w * bpp
-        raw += data_for_idat_processing[start : start + idat_processing_w * bpp]
-    compressed = zlib.compress(raw)
-    write_chunk(output_stream, b'IDAT', compressed)
+    # Prepend the filter byte (type 0) to each row with NumPy, a band of rows at a time
+    row_bytes = idat_processing_w * bpp
+    pixels = np.frombuffer(data_for_idat_processing, dtype=np.uint8, count=idat_processing_h * row_bytes).reshape(idat_processing_h, row_bytes)
+    band = max(1, (1 << 20) // (row_bytes + 1))
+    filtered = np.zeros((min(band, idat_processing_h), 1 + row_bytes), dtype=np.uint8)
+    # The payload is usually incompressible, so a low deflate level costs little in size
+    compressor = zlib.compressobj(level)
 
-    write_chunk(output_stream, b'IEND', b'')
+    def compressed_bands():
+        for start in range(0, idat_processing_h, band):
+            rows = pixels[start : start + band]
+            block = filtered[:len(rows)]
+            block[:, 1:] = rows
+            yield compressor.compress(block) # the block is contiguous, no need for a tobytes() copy
+        yield compressor.flush()
 
-def decode(input_stream, output_stream, length_override, rand_source, width=None, height=None, uw=None, uh=None):
-    import png  # you still need `pypng`
+    with _buffered(output_stream) as out:
+        # Signature, IHDR and iTXt go out in a single write
+        out.write(b"".join((
+            b"\x89PNG\r\n\x1a\n",
+            chunk_bytes(b'IHDR', ihdr),
+            chunk_bytes(b"iTXt", itxt_keyword_and_params + itxt_text_content.encode("utf-8")),
+        )))
+        write_chunk_streamed(out, b'IDAT', compressed_bands())
+        write_chunk(out, b'IEND', b'')
 
-    r = png.Reader(file=input_stream)
-    w, h, pixels, meta = r.read_flat()
-    img_data = bytes(pixels)
+def iter_chunks(input_stream, wanted, verify=False):
+    """
+    Yield (chunk_type, data) for the chunks of a PNG stream. Only chunk types in wanted are read,
+    everything else is seeked over (data and CRC), so e.g. IDAT costs nothing unless asked for.
+    CRCs are not checked unless verify is true, in which case a wanted chunk whose CRC does not
+    match raises ValueError. Skipped chunks are never checked.
+    Stops at IEND, at the end of the stream, or right away if the PNG signature is missing.
+    """
+    if input_stream.read(8) != b"\x89PNG\r\n\x1a\n":
+        return
+    while True:
+        header = input_stream.read(8)
+        if len(header) < 8:
+            return
+        length, chunk_type = _CHUNK_HEADER.unpack(header)
+        if chunk_type in wanted:
+            data = input_stream.read(length)
+            if verify:
+                stored = input_stream.read(4)
+                checksum = zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff
+                if len(stored) < 4 or _U32.unpack(stored)[0] != checksum:
+                    raise ValueError(f"CRC mismatch in {chunk_type.decode('latin-1')} chunk")
+            else:
+                input_stream.seek(4, 1) # CRC
+            yield chunk_type, data
+        else:
+            input_stream.seek(length + 4, 1)
+        if chunk_type == b'IEND':
+            return
 
-    decoded_length_from_header = None
+def read_itxt_text(input_stream, keyword):
+    """
+    Return the text of the first iTXt chunk with the given keyword (bytes), or None.
+    Only chunk headers and iTXt chunks are read, so this is cheap even for huge images.
+    """
+    for _, chunk_data in iter_chunks(input_stream, (b'iTXt',)):
+        # iTXt layout: keyword\0 compression_flag compression_method lang_tag\0 translated_keyword\0 text
+        keyword_end = chunk_data.find(b'\x00')
+        if chunk_data[:keyword_end] != keyword:
+            continue
+        compressed = chunk_data[keyword_end + 1]
+        lang_end = chunk_data.index(b'\x00', keyword_end + 3)
+        text_start = chunk_data.index(b'\x00', lang_end + 1) + 1
+        text = chunk_data[text_start:]
+        if compressed:
+            text = zlib.decompress(text)
+        return text.decode('utf-8')
+    return None
 
-    if 'itxt' in meta:
-        for itxt_keyword, lang_tag, translated_keyword, actual_text_content in meta['itxt']:
-            if itxt_keyword == 'license':
-                try:
-                    parts = actual_text_content.strip().split(' ', 1) # Add .strip() before splitting
-                    if len(parts) == 2:
-                        part1_hex_len_of_part2_str = parts[0]
-                        part2_hex_original_file_size_str = parts[1]
-                        
-                        # ---
-                        # Optional: Validate part1 against actual length of part2
-                        try:
-                            expected_len_of_part2_val_from_header = int.from_bytes(bytes.fromhex(part1_hex_len_of_part2_str), 'big')
-                            actual_len_of_part2_str_in_bytes = len(part2_hex_original_file_size_str.encode('utf-8'))
-                            if expected_len_of_part2_val_from_header != actual_len_of_part2_str_in_bytes:
-                                print(f"Warning: iTXt 'license' header length field mismatch. Expected length of second part string: {expected_len_of_part2_val_from_header}, actual: {actual_len_of_part2_str_in_bytes}.", file=sys.stderr)
-                        except ValueError: # Handle potential error from int.from_bytes(bytes.fromhex(...))
-                            print(f"Warning: Could not validate part1 of iTXt 'license' header due to hex conversion error.", file=sys.stderr)
-                        # ---
-
-                        decoded_length_from_header = int.from_bytes(bytes.fromhex(part2_hex_original_file_size_str), 'big')
-                        break # Found and parsed our header
-                except ValueError:
-                    print("Warning: Could not parse 'license' iTXt header value (ValueError on hex conversion or split).", file=sys.stderr)
-                except Exception as e:
-                    print(f"Warning: Error processing 'license' iTXt header: {e}", file=sys.stderr)
+def read_pixels_fast(input_stream):
+    """
+    Read the pixel data of an 8-bit RGBA, non-interlaced PNG whose rows all use filter type 0,
+    as written by encode. IDAT is inflated as raw deflate so the Adler-32 trailer is never
+    verified; instead the CRC of every IHDR and IDAT chunk is checked, which covers the same bytes.
+    Returns (w, h, img_data), or None if the image needs the full reader (including when a CRC
+    does not match or the stream is corrupt, so the full reader reports the error).
+    """
+    import numpy as np
+
+    w = h = None
+    inflater = zlib.decompressobj(-15)
+    zlib_header_left = 2 # CMF and FLG bytes in front of the raw deflate stream
+    parts = []
+    try:
+        for chunk_type, data in iter_chunks(input_stream, (b'IHDR', b'IDAT', b'IEND'), verify=True):
+            if chunk_type == b'IHDR':
+                w, h, bit_depth, colour_type, _, _, interlace = _IHDR.unpack(data)
+                if (bit_depth, colour_type, interlace) != (8, 6, 0):
+                    return None
+            elif chunk_type == b'IDAT':
+                if zlib_header_left:
+                    skipped = min(zlib_header_left, len(data))
+                    data = memoryview(data)[skipped:] # avoid copying the (usually single, full size) IDAT
+                    zlib_header_left -= skipped
+                parts.append(inflater.decompress(data))
+            elif chunk_type == b'IEND':
+                break
+    except (ValueError, struct.error, zlib.error): # CRC mismatch or corrupt chunk/deflate stream
+        return None
+
+    if w is None:
+        return None
+    stride = 1 + w * 4
+    filtered = b''.join(parts)
+    if len(filtered) < h * stride:
+        return None
+    rows = np.frombuffer(filtered, dtype=np.uint8, count=h * stride).reshape(h, stride)
+    if rows[:, 0].any(): # some row uses a real filter, leave unfiltering to pypng
+        return None
+    return w, h, rows[:, 1:].tobytes()
+
+def decode(input_stream, output_stream, length_override, rand_source, width=None, height=None, uw=None, uh=None, fast=False):
+    if not input_stream.seekable(): # The iTXt scan, the fast reader and Pillow all rewind or seek
+        input_stream = io.BytesIO(input_stream.read())
+
+    # Find the length header by scanning chunk headers, before (and without) decoding any pixels
+    header_text = None # Text of the 'license' iTXt chunk
+    try:
+        header_text = read_itxt_text(input_stream, b'license')
+    except Exception as e:
+        print(f"Warning: Error reading iTXt chunks: {e}", file=sys.stderr)
+    input_stream.seek(0)
+
+    pixels = None
+    if fast:
+        pixels = read_pixels_fast(input_stream)
+        input_stream.seek(0)
+
+    if pixels is not None:
+        w, h, img_data = pixels
     else:
-        # Fallback: manually parse iTXt chunks if pypng didn't provide them
-        input_stream.seek(0)  # Reset stream position
-        r_chunks = png.Reader(file=input_stream)
         try:
-            for chunk_type, chunk_data in r_chunks.chunks():
-                if chunk_type == b'iTXt':
-                    # Parse iTXt chunk format: keyword\0lang_tag\0translated_keyword\0\0text
-                    null_positions = []
-                    for i, byte in enumerate(chunk_data):
-                        if byte == 0:
-                            null_positions.append(i)
-                    
-                    if len(null_positions) >= 4:
-                        keyword = chunk_data[:null_positions[0]].decode('utf-8')
-                        if keyword == 'license':
-                            text_start_pos = null_positions[4] + 1
-                            actual_text_content = chunk_data[text_start_pos:].decode('utf-8')
-                            
-                            try:
-                                parts = actual_text_content.strip().split(' ', 1)
-                                if len(parts) == 2:
-                                    part1_hex_len_of_part2_str = parts[0]
-                                    part2_hex_original_file_size_str = parts[1]
-                                    
-                                    # ---
-                                    # Optional: Validate part1 against actual length of part2
-                                    try:
-                                        expected_len_of_part2_val_from_header = int.from_bytes(bytes.fromhex(part1_hex_len_of_part2_str), 'big')
-                                        actual_len_of_part2_str_in_bytes = len(part2_hex_original_file_size_str.encode('utf-8'))
-                                        if expected_len_of_part2_val_from_header != actual_len_of_part2_str_in_bytes:
-                                            print(f"Warning: iTXt 'license' header length field mismatch. Expected length of second part string: {expected_len_of_part2_val_from_header}, actual: {actual_len_of_part2_str_in_bytes}.", file=sys.stderr)
-                                    except ValueError: # Handle potential error from int.from_bytes(bytes.fromhex(...))
-                                        print(f"Warning: Could not validate part1 of iTXt 'license' header due to hex conversion error.", file=sys.stderr)
-                                    # ---
-
-                                    decoded_length_from_header = int.from_bytes(bytes.fromhex(part2_hex_original_file_size_str), 'big')
-                                    break # Found and parsed our header
-                            except ValueError:
-                                print("Warning: Could not parse 'license' iTXt header value (ValueError on hex conversion or split).", file=sys.stderr)
-                            except Exception as e:
-                                print(f"Warning: Error processing 'license' iTXt header: {e}", file=sys.stderr)
-                    break  # Only process the first iTXt chunk
+            from PIL import Image
+        except ImportError: # Pillow is preferred, pypng still works as a (much slower) fallback
+            Image = None
+
+        if Image is not None:
+            Image.MAX_IMAGE_PIXELS = None # Payload images are as large as the data; pypng had no such limit either
+            with Image.open(input_stream) as img:
+                if header_text is None:
+                    header_text = img.text.get('license')
+                if img.mode != 'RGBA':
+                    img = img.convert('RGBA')
+                w, h = img.size
+                img_data = img.tobytes()
+        else:
+            import png
+            r = png.Reader(file=input_stream)
+            # RGBA like the Pillow path, whatever the colour type; join the rows once rather than
+            # letting read_flat() chain them into an array and copying that
+            w, h, rows, meta = r.asRGBA8()
+            img_data = b''.join(rows)
+
+    decoded_length_from_header = None
+
+    if header_text is not None:
+        try:
+            parts = header_text.strip().split(' ', 1) # Add .strip() before splitting
+            if len(parts) == 2:
+                part1_hex_len_of_part2_str = parts[0]
+                part2_hex_original_file_size_str = parts[1]
+                
+                # ---
+                # Optional: Validate part1 against actual length of part2
+                try:
+                    expected_len_of_part2_val_from_header = int.from_bytes(bytes.fromhex(part1_hex_len_of_part2_str), 'big')
+                    actual_len_of_part2_str_in_bytes = len(part2_hex_original_file_size_str.encode('utf-8'))
+                    if expected_len_of_part2_val_from_header != actual_len_of_part2_str_in_bytes:
+                        print(f"Warning: iTXt 'license' header length field mismatch. Expected length of second part string: {expected_len_of_part2_val_from_header}, actual: {actual_len_of_part2_str_in_bytes}.", file=sys.stderr)
+                except ValueError: # Handle potential error from int.from_bytes(bytes.fromhex(...))
+                    print(f"Warning: Could not validate part1 of iTXt 'license' header due to hex conversion error.", file=sys.stderr)
+                # ---
+
+                decoded_length_from_header = int.from_bytes(bytes.fromhex(part2_hex_original_file_size_str), 'big')
+        except ValueError:
+            print("Warning: Could not parse 'license' iTXt header value (ValueError on hex conversion or split).", file=sys.stderr)
         except Exception as e:
-            print(f"Warning: Error reading iTXt chunks: {e}", file=sys.stderr)
+            print(f"Warning: Error processing 'license' iTXt header: {e}", file=sys.stderr)
 
     final_length_target = length_override if length_override is not None else decoded_length_from_header
 
     # Only output up to the embedded data length, not the full RGBA image
     max_embedded_bytes = w * h * 4  # RGBA
+    img_view = memoryview(img_data)  # slice without copying the pixel buffer
 
     if final_length_target is not None:
         # Output exactly the number of bytes specified by the header (or -l), padding only if needed
         if final_length_target <= max_embedded_bytes:
-            output_stream.write(img_data[:final_length_target])
+            output_stream.write(img_view[:final_length_target])
         else:
-            output_stream.write(img_data[:max_embedded_bytes])
+            output_stream.write(img_view[:max_embedded_bytes])
             padding_needed = final_length_target - max_embedded_bytes
             padding_bytes = read_bytes_from_source(padding_needed, rand_source)
             output_stream.write(padding_bytes)
     else:
         # No length specified from header or CLI, write all embedded data (not padded RGBA)
-        output_stream.write(img_data[:max_embedded_bytes])
+        output_stream.write(img_view[:max_embedded_bytes])
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("-e", "--encode", action="count", default=0)
-    parser.add_argument("-d", "--decode", action="count", default=0)
+    # Operations are collected in command line order, whichever way the flags are spelt (-ed, --enc, ...)
+    parser.add_argument("-e", "--encode", action="append_const", const="encode", dest="ops")
+    parser.add_argument("-d", "--decode", action="append_const", const="decode", dest="ops")
     parser.add_argument("-l", "--length", type=int)
     parser.add_argument("-r", "--rand", type=str)
     parser.add_argument("-W", "--width", type=int)
     parser.add_argument("-H", "--height", type=int)
     parser.add_argument("-uw", "--upscale-width", type=int)
     parser.add_argument("-uh", "--upscale-height", type=int)
+    parser.add_argument("--resample", choices=["nearest", "bilinear", "bicubic", "lanczos"])
+    parser.add_argument("-z", "--level", type=int, choices=range(10), default=1)
+    parser.add_argument("--uncompressed", dest="level", action="store_const", const=0)
     parser.add_argument("-f", "--file", type=str)
+    parser.add_argument("--fast", action="store_true")
     args = parser.parse_args()
 
-    op_sequence = []
-    for a in sys.argv:
-        if a in ("-e", "--encode"): op_sequence.append("encode")
-        if a in ("-d", "--decode"): op_sequence.append("decode")
-
     data_in = sys.stdin.buffer
     data_out = sys.stdout.buffer
     if args.file:
@@ -323,13 +540,17 @@ def main():
     else:
         out = data_out
 
-    for op in op_sequence:
-        if op == "encode":
-            encode(data_in, out, args.width, args.height, args.length, args.rand, args.upscale_width, args.upscale_height)
-            return
-        elif op == "decode":
-            decode(data_in, out, args.length, args.rand, args.width, args.height, args.upscale_width, args.upscale_height)
-            return
+    try:
+        for op in args.ops or []:
+            if op == "encode":
+                encode(data_in, out, args.width, args.height, args.length, args.rand, args.upscale_width, args.upscale_height, args.resample, args.level)
+                return
+            elif op == "decode":
+                decode(data_in, out, args.length, args.rand, args.width, args.height, args.upscale_width, args.upscale_height, args.fast)
+                return
+    finally:
+        if out is not data_out:
+            out.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file